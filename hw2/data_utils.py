@@ -1,8 +1,5 @@
 import os
 import re
-import json
-import gensim
-import tqdm
 import numpy as np
 from collections import Counter
 from spacy.lang.en import English
@@ -100,29 +97,6 @@ def build_output_tables(train):
     return actions_to_index, index_to_actions, targets_to_index, index_to_targets
 
 
-def read_analogies(analogies_fn):
-    with open(analogies_fn, "r") as f:
-        pairs = json.load(f)
-    return pairs
-
-
-def save_word2vec_format(fname, model, i2v):
-    print("Saving word vectors to file...")  # DEBUG
-    with gensim.utils.open(fname, "wb") as fout:
-        fout.write(
-            gensim.utils.to_utf8("%d %d\n" % (model.n_vocab, model.n_embedding))
-        )
-        # store in sorted order: most frequent words at the top
-        for index in tqdm.tqdm(range(len(i2v))):
-            word = i2v[index]
-            row = model.embedding_layer.weight.data[index]
-            fout.write(
-                gensim.utils.to_utf8(
-                    "%s %s\n" % (word, " ".join("%f" % val for val in row))
-                )
-            )
-
-
 def encode_data(data, v2i, seq_len):
     num_insts = sum([len(ep) for ep in data])
     x = np.zeros((num_insts, seq_len), dtype=np.int32)
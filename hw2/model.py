@@ -18,7 +18,38 @@ class CBOWModel(nn.Module):
         self.fc = nn.Linear(in_features=n_embedding, out_features=n_vocab)
 
     def forward(self, input_token):
+        # (B, 2 * context_window_len) -> (B, n_embedding) -> (B, n_vocab)
         embedding_out = torch.sum(self.embedding_layer(input_token), dim=1)
         fc_out = self.fc(embedding_out)
 
         return fc_out
+
+
+class SkipGramModel(nn.Module):
+    """
+    Define model for learning word embeddings (Skip-Gram)
+    Token -> context
+    """
+
+    def __init__(self, n_vocab: int, n_embedding: int, context_window_len: int):
+        super(SkipGramModel, self).__init__()
+        self.n_vocab = n_vocab
+        self.n_embedding = n_embedding
+        self.context_window_len = context_window_len
+        self.embedding_layer = nn.Embedding(num_embeddings=n_vocab, embedding_dim=n_embedding)
+        self.fc = nn.Linear(in_features=n_embedding, out_features=n_vocab)
+
+    def forward(self, input_token):
+        # (B,) -> (B, n_embedding) -> (B, n_vocab)
+        embedding_out = self.embedding_layer(input_token)
+        fc_out = self.fc(embedding_out)
+
+        return fc_out
+
+    def get_multi_hot_labels(self, context):
+        """
+        Expand (B, 2 * context_window_len) context indices to (B, n_vocab) multi-hot labels on context's device
+        (e.g. for torch.nn.BCEWithLogitsLoss)
+        """
+        labels = torch.zeros(context.shape[0], self.n_vocab, device=context.device)
+        return labels.scatter_(1, context, 1.0)
@@ -3,8 +3,6 @@ import os
 
 import tqdm
 import torch
-from sklearn.metrics import accuracy_score
-from torch.utils.data import TensorDataset, DataLoader
 
 from eval_utils import downstream_validation
 import utils
@@ -12,11 +10,11 @@ import data_utils
 from model import CBOWModel
 
 
-def setup_dataloader(args, context_window_len):
+def build_dataset(args, context_window_len):
     """
     return:
-        - train_loader: torch.utils.data.Dataloader
-        - val_loader: torch.utils.data.Dataloader
+        - index_to_vocab: dict
+        - train_input, train_labels, val_input, val_labels: numpy.ndarray
     """
 
     # read in training data from books dataset
@@ -51,7 +49,7 @@ def setup_dataloader(args, context_window_len):
     # Split all sentences: train and validation
     print("INFO: Start parsing sentences to train and validation dataset")
     train_sentences, val_sentences, train_sentences_lens, val_sentences_lens = utils.create_train_val_splits(
-        all_sentences=encoded_sentences, lens=lens)
+        all_sentences=encoded_sentences, lens=lens, prop_train=args.prop_train, seed=args.seed)
 
     pad_token = vocab_to_index['<pad>']
 
@@ -60,13 +58,36 @@ def setup_dataloader(args, context_window_len):
                                                                 train_sentences_lens)
     val_input, val_labels = utils.get_input_label_data_cbow(val_sentences, context_window_len, pad_token,
                                                             val_sentences_lens)
+    print("INFO: Finished parsing sentences to train and validation dataset")
+    return index_to_vocab, train_input, train_labels, val_input, val_labels
 
-    train_dataset = TensorDataset(torch.from_numpy(train_input), torch.from_numpy(train_labels))
-    val_dataset = TensorDataset(torch.from_numpy(val_input), torch.from_numpy(val_labels))
 
-    train_loader = DataLoader(train_dataset, shuffle=True, batch_size=args.batch_size)
-    val_loader = DataLoader(val_dataset, shuffle=False, batch_size=args.batch_size)
-    print("INFO: Finished parsing sentences to train and validation dataset")
+def setup_dataloader(args, context_window_len, device):
+    """
+    return:
+        - train_loader: utils.TensorBatchLoader
+        - val_loader: utils.TensorBatchLoader
+    """
+    # reuse the encoded dataset of a previous run with the same data and preprocessing parameters
+    cache_path = utils.get_dataset_cache_path(args.cache_dir, args.data_dir, args.vocab_size, context_window_len,
+                                              args.seed, args.prop_train)
+    if not args.no_cache and os.path.exists(cache_path + ".npz"):
+        print("INFO: Loading cached dataset from", cache_path)
+        index_to_vocab, train_input, train_labels, val_input, val_labels = utils.load_dataset_cache(cache_path)
+    else:
+        index_to_vocab, train_input, train_labels, val_input, val_labels = build_dataset(args, context_window_len)
+        if not args.no_cache:
+            print("INFO: Caching dataset to", cache_path)
+            utils.save_dataset_cache(cache_path, index_to_vocab, train_input, train_labels, val_input, val_labels)
+
+    # the whole dataset is small enough to live on the device, batches are just slices of it
+    # cast once to int64 (required by nn.Embedding / CrossEntropyLoss) instead of every batch
+    train_loader = utils.TensorBatchLoader(torch.from_numpy(train_input).to(device, dtype=torch.int64),
+                                           torch.from_numpy(train_labels).to(device, dtype=torch.int64),
+                                           batch_size=args.batch_size, shuffle=True)
+    val_loader = utils.TensorBatchLoader(torch.from_numpy(val_input).to(device, dtype=torch.int64),
+                                         torch.from_numpy(val_labels).to(device, dtype=torch.int64),
+                                         batch_size=args.batch_size, shuffle=False)
     return train_loader, val_loader, index_to_vocab
 
 
@@ -109,24 +130,26 @@ def train_epoch(
     training=True,
 ):
     model.train()
-    epoch_loss = 0.0
+    # accumulate loss and correct predictions on device, only sync with the host once per epoch
+    epoch_loss = torch.zeros((), device=device)
+    n_correct = torch.zeros((), device=device, dtype=torch.long)
+    n_total = 0
 
-    # keep track of the model predictions for computing accuracy
-    pred_labels = []
-    target_labels = []
+    # older GPUs (e.g. T4, V100) only emulate bf16, keep fp32 there
+    # (is_bf16_supported() also counts emulation, so check for Ampere+ compute capability instead)
+    use_bf16 = device.type == "cuda" and torch.cuda.get_device_capability(device)[0] >= 8
 
     # iterate over each batch in the dataloader
-    # NOTE: you may have additional outputs from the loader __getitem__, you can modify this
+    # NOTE: batches are already int64 tensors on device (see setup_dataloader)
     for (inputs, labels) in tqdm.tqdm(loader):
-        # put model inputs to device
-        inputs, labels = inputs.to(device).long(), labels.to(device).long()
-
         # calculate the loss and train accuracy and perform backprop
         # NOTE: feel free to change the parameters to the model forward pass here + outputs
-        pred_logits = model(inputs)
+        # bf16 autocast on GPUs with native bf16: embedding table stays fp32, the fc matmul runs on tensor cores
+        with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+            pred_logits = model(inputs)
 
-        # calculate prediction loss
-        loss = criterion(pred_logits.squeeze(), labels)
+            # calculate prediction loss
+            loss = criterion(pred_logits, labels)
 
         # step optimizer and compute gradients during training
         if training:
@@ -135,16 +158,16 @@ def train_epoch(
             optimizer.step()
 
         # logging
-        epoch_loss += loss.item()
+        epoch_loss += loss.detach()
 
         # compute metrics
         # CBOW
         preds = pred_logits.argmax(-1)
-        pred_labels.extend(preds.cpu().numpy())
-        target_labels.extend(labels.cpu().numpy())
+        n_correct += (preds == labels).sum()
+        n_total += labels.numel()
 
-    acc = accuracy_score(pred_labels, target_labels)
-    epoch_loss /= len(loader)
+    acc = n_correct.item() / n_total
+    epoch_loss = epoch_loss.item() / len(loader)
 
     return epoch_loss, acc
 
@@ -182,14 +205,20 @@ def main(args):
 
     # get dataloaders
     context_window_len = 2      # context window length
-    train_loader, val_loader, index_to_vocab = setup_dataloader(args, context_window_len)
+    train_loader, val_loader, index_to_vocab = setup_dataloader(args, context_window_len, device)
     loaders = {"train": train_loader, "val": val_loader}
 
     # build model
     # Reserve 4 for 4 special tokens (<pad>...)
-    model = setup_model(args, n_vocab=args.vocab_size, context_window_len=context_window_len)
+    model = setup_model(args, n_vocab=args.vocab_size, context_window_len=context_window_len).to(device)
     print(model)
 
+    # compiled wrapper is only used for training / validation steps,
+    # the plain model is kept for checkpoints and word vector export
+    train_model = model
+    if not args.no_compile and hasattr(torch, "compile"):
+        train_model = torch.compile(model)
+
     # get optimizer
     criterion, optimizer = setup_optimizer(args, model, device)
 
@@ -203,7 +232,7 @@ def main(args):
         print(f"Epoch {epoch}")
         train_loss, train_acc = train_epoch(
             args,
-            model,
+            train_model,
             loaders["train"],
             optimizer,
             criterion,
@@ -217,7 +246,7 @@ def main(args):
         if epoch % args.val_every == 0:
             val_loss, val_acc = validate(
                 args,
-                model,
+                train_model,
                 loaders["val"],
                 optimizer,
                 criterion,
@@ -239,7 +268,8 @@ def main(args):
             # # save word vectors
             # word_vec_file = os.path.join(args.outputs_dir, args.word_vector_fn)
             # print("saving word vec to ", word_vec_file)
-            # utils.save_word2vec_format(word_vec_file, model, index_to_vocab)
+            # utils.save_word2vec_format(word_vec_file, model, index_to_vocab,
+            #                            dtype=getattr(torch, args.word_vector_dtype))
             #
             # # evaluate learned embeddings on a downstream task
             # downstream_validation(word_vec_file, external_val_analogies)
@@ -258,7 +288,7 @@ def main(args):
     # save word vectors
     word_vec_file = os.path.join(args.outputs_dir, args.word_vector_fn)
     print("saving word vec to ", word_vec_file)
-    utils.save_word2vec_format(word_vec_file, model, index_to_vocab)
+    utils.save_word2vec_format(word_vec_file, model, index_to_vocab, dtype=getattr(torch, args.word_vector_dtype))
 
     # evaluate learned embeddings on a downstream task
     downstream_validation(word_vec_file, external_val_analogies)
@@ -295,6 +325,10 @@ if __name__ == "__main__":
         "--word_vector_fn", type=str, help="filepath to store the learned word vectors",
         default='learned_word_vectors.txt'
     )
+    parser.add_argument(
+        "--word_vector_dtype", type=str, default="float32", choices=["float32", "bfloat16"],
+        help="precision of the saved word vectors (bfloat16 only shrinks the text file ~5%%)"
+    )
     parser.add_argument(
         "--num_epochs", default=30, type=int, help="number of training epochs"
     )
@@ -314,6 +348,11 @@ if __name__ == "__main__":
     # Task (optional): Add any additional command line
     # parameters you may need here
     # ===================================================== #
+    parser.add_argument("--no_compile", action="store_true", help="train without torch.compile")
+    parser.add_argument("--prop_train", type=float, default=0.7, help="proportion of sentences used for training")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the train/validation split")
+    parser.add_argument("--cache_dir", type=str, default="cache", help="where to cache the encoded dataset")
+    parser.add_argument("--no_cache", action="store_true", help="always re-build the dataset from data_dir")
 
     args = parser.parse_args()
     main(args)
\ No newline at end of file
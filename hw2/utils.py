@@ -1,6 +1,10 @@
+import hashlib
+import itertools
 import json
+import math
+import pickle
+import threading
 import gensim
-import numpy
 import tqdm
 import numpy as np
 import torch
@@ -9,6 +13,9 @@ import matplotlib.pyplot as plt
 import data_utils
 import os
 
+# bump whenever the encoding / input-label builders change, so stale dataset caches are not reused
+DATASET_CACHE_VERSION = 1
+
 
 def read_analogies(analogies_fn):
     with open(analogies_fn, "r") as f:
@@ -16,66 +23,195 @@ def read_analogies(analogies_fn):
     return pairs
 
 
-def save_word2vec_format(fname, model, i2v):
+def save_word2vec_format(fname, model, i2v, dtype=torch.float32, write_batch_size=1024):
+    """
+    Save embeddings in word2vec text format
+    Pass dtype=torch.bfloat16 to round weights to bfloat16 (written with %g) before saving. Since the output is text,
+    this only makes the file ~5% smaller while losing up to ~1e-2 precision per value, so full precision is the default
+    """
     print("Saving word vectors to file...")  # DEBUG
     with gensim.utils.open(fname, "wb") as fout:
         fout.write(
             gensim.utils.to_utf8("%d %d\n" % (model.n_vocab, model.n_embedding))
         )
+        # copy the embedding matrix to host once and format each row with a single % operation
+        weights = model.embedding_layer.weight.detach().to(dtype).float().cpu().numpy()
+        row_format = " ".join(["%g" if dtype != torch.float32 else "%f"] * weights.shape[1])
         # store in sorted order: most frequent words at the top
-        for index in tqdm.tqdm(range(len(i2v))):
-            word = i2v[index]
-            row = model.embedding_layer.weight.data[index]
-            fout.write(
+        # rows are written in chunks of write_batch_size to cut per-write overhead of the (compressed) file
+        # i2v is a dict: look up the words in index order once instead of inside the loop
+        words = [i2v[index] for index in range(len(i2v))]
+        buffer = []
+        for word, row in tqdm.tqdm(zip(words, weights.tolist()), total=len(words)):
+            buffer.append(
                 gensim.utils.to_utf8(
-                    "%s %s\n" % (word, " ".join("%f" % val for val in row))
+                    "%s %s\n" % (word, row_format % tuple(row))
                 )
             )
+            if len(buffer) >= write_batch_size:
+                fout.write(b"".join(buffer))
+                buffer.clear()
+        if buffer:
+            fout.write(b"".join(buffer))
 
 
-def get_token(sentence: list, index: int, pad_token: int):
+def get_dataset_cache_path(cache_dir: str, data_dir: str, vocab_size: int, context_window_len: int, seed: int,
+                           prop_train: float):
+    """
+    Get cache file path (without extension) of the encoded dataset, keyed by data and preprocessing parameters
     """
-    get token at input index of the sentence
+    # key on every file's (path, size, mtime): a directory's own mtime misses books edited in place
+    data_files = []
+    for root, dirs, fns in os.walk(data_dir):
+        for fn in fns:
+            stat = os.stat(os.path.join(root, fn))
+            data_files.append((os.path.relpath(os.path.join(root, fn), data_dir), stat.st_size, stat.st_mtime_ns))
+    key = "%d-%s-%s-%d-%d-%d-%f" % (DATASET_CACHE_VERSION, os.path.abspath(data_dir), sorted(data_files), vocab_size,
+                                    context_window_len, seed, prop_train)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest()[:16])
+
+
+def save_dataset_cache(cache_path: str, index_to_vocab: dict, train_input, train_labels, val_input, val_labels):
     """
-    return pad_token if (index < 0 or index >= len(sentence)) else sentence[index]
+    Save encoded dataset to cache_path.npz and vocab to cache_path.pkl
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # .pkl first and .npz last, each written to a temp file and renamed into place:
+    # an existing .npz (what setup_dataloader checks) then always means a complete cache
+    with open(cache_path + ".tmp.pkl", "wb") as f:
+        pickle.dump(index_to_vocab, f)
+    os.replace(cache_path + ".tmp.pkl", cache_path + ".pkl")
+    np.savez(cache_path + ".tmp.npz", train_input=train_input, train_labels=train_labels, val_input=val_input,
+             val_labels=val_labels)
+    os.replace(cache_path + ".tmp.npz", cache_path + ".npz")
+
+
+def load_dataset_cache(cache_path: str):
+    """
+    Load encoded dataset saved by save_dataset_cache
+    """
+    with np.load(cache_path + ".npz") as data:
+        train_input, train_labels = data["train_input"], data["train_labels"]
+        val_input, val_labels = data["val_input"], data["val_labels"]
+    with open(cache_path + ".pkl", "rb") as f:
+        index_to_vocab = pickle.load(f)
+    return index_to_vocab, train_input, train_labels, val_input, val_labels
 
 
-def create_train_val_splits(all_sentences: list, lens: list, prop_train=0.7):
+def create_train_val_splits(all_sentences: list, lens: list, prop_train=0.7, seed=None):
     """
     Split all input sentences to train and validation
     Reference: code snippet from coding activity 3
     """
-    train_sentences = []
-    val_sentences = []
-    train_sentences_lens = []
-    val_sentences_lens = []
-    train_idxs = np.random.choice(list(range(len(all_sentences))), size=int(len(all_sentences) * prop_train + 0.5),
-                                  replace=False)
-    train_sentences.extend([all_sentences[idx] for idx in range(len(all_sentences)) if idx in train_idxs])
-    train_sentences_lens.extend([lens[idx] for idx in range(len(lens)) if idx in train_idxs])
-    val_sentences.extend([all_sentences[idx] for idx in range(len(all_sentences)) if idx not in train_idxs])
-    val_sentences_lens.extend([lens[idx] for idx in range(len(lens)) if idx not in train_idxs])
+    n_sentences = len(all_sentences)
+    train_idxs = np.random.default_rng(seed).permutation(n_sentences)[:int(n_sentences * prop_train + 0.5)]
+    is_train = np.zeros(n_sentences, dtype=bool)
+    is_train[train_idxs] = True
+
+    train_sentences, val_sentences = split_by_mask(all_sentences, is_train)
+    train_sentences_lens, val_sentences_lens = split_by_mask(lens, is_train)
     return train_sentences, val_sentences, train_sentences_lens, val_sentences_lens
 
 
+def split_by_mask(data, mask):
+    """
+    Split data into (data[mask], data[~mask]), keeping the original order
+    """
+    if isinstance(data, np.ndarray):
+        return data[mask], data[~mask]
+    return list(itertools.compress(data, mask)), list(itertools.compress(data, ~mask))
+
+
+def get_context_windows(sentences: list, context_window_len: int, lens: list):
+    """
+    Get every (2 * context_window_len + 1)-token window of all sentences, centered on each valid token
+    All windows are built at once with a sliding window view
+    """
+    sentences = np.asarray(sentences, dtype=np.int32)
+    lens = np.asarray(lens, dtype=np.int32).reshape(-1, 1)
+    window_len = 2 * context_window_len + 1
+    if len(sentences) == 0 or sentences.shape[1] < window_len:
+        return np.empty((0, window_len), dtype=np.int32)
+
+    # windows: (N, L - 2 * context_window_len, 2 * context_window_len + 1)
+    windows = np.lib.stride_tricks.sliding_window_view(sentences, window_len, axis=1)
+    # only keep windows whose last context token lies before the sentence end (lens)
+    valid = np.arange(windows.shape[1]) < (lens[:, 0] - 2 * context_window_len)[:, None]
+
+    return windows[valid]
+
+
 def get_input_label_data_cbow(sentences: list, context_window_len: int, pad_token: int, lens: list):
     """
-    Parse all sentences and get input and labels (skip_gram)
+    Parse all sentences and get input and labels (cbow)
     context -> token
     """
-    context_list = []
-    tokens = []
+    windows = get_context_windows(sentences, context_window_len, lens)
+    keep = np.arange(windows.shape[1]) != context_window_len
+
+    return windows[:, keep], windows[:, context_window_len]
+
+
+def get_input_label_data_skip_gram(sentences: list, context_window_len: int, lens: list):
+    """
+    Parse all sentences and get input and labels (skip_gram)
+    token -> context
+    Context is kept as (M, 2 * context_window_len) vocab indices instead of n_vocab one-hot rows
+    """
+    windows = get_context_windows(sentences, context_window_len, lens)
+    keep = np.arange(windows.shape[1]) != context_window_len
+
+    return windows[:, context_window_len], windows[:, keep]
 
-    for (sentence_index, sentence) in enumerate(sentences):
-        for i in range(context_window_len, lens[sentence_index][0] - context_window_len):
-            tokens.append(sentence[i])
-            context = []
-            for index in range(i - context_window_len, i + context_window_len + 1):
-                if index != i:
-                    context.append(get_token(sentence, index, pad_token))
-            context_list.append(context)
 
-    return numpy.array(context_list), numpy.array(tokens)
+class TensorBatchLoader:
+    """
+    Iterate over (inputs, labels) batches by slicing in-memory tensors
+    Replaces TensorDataset + DataLoader: no per-sample __getitem__, collate or worker processes
+    """
+
+    def __init__(self, inputs: torch.Tensor, labels: torch.Tensor, batch_size: int, shuffle: bool):
+        self.inputs = inputs
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        # own generator: the permutation is drawn on a background thread, away from the global RNG
+        # seeded from the global RNG so torch.manual_seed still controls the epoch shuffles
+        self.generator = None
+        if shuffle:
+            self.generator = torch.Generator(device=inputs.device)
+            self.generator.manual_seed(int(torch.randint(2 ** 62, ()).item()))
+        self.next_perm = None
+        self.perm_thread = None
+
+    def __len__(self):
+        return math.ceil(len(self.inputs) / self.batch_size)
+
+    def start_next_perm(self):
+        """
+        Compute the permutation of the next epoch in a background thread while the current epoch trains
+        """
+        def compute_perm():
+            self.next_perm = torch.randperm(len(self.inputs), generator=self.generator, device=self.inputs.device)
+
+        self.perm_thread = threading.Thread(target=compute_perm, daemon=True)
+        self.perm_thread.start()
+
+    def __iter__(self):
+        n_samples = len(self.inputs)
+        perm = None
+        if self.shuffle:
+            if self.perm_thread is None:
+                self.start_next_perm()
+            self.perm_thread.join()
+            perm = self.next_perm
+            self.start_next_perm()
+        for start in range(0, n_samples, self.batch_size):
+            if perm is None:
+                yield self.inputs[start:start + self.batch_size], self.labels[start:start + self.batch_size]
+            else:
+                batch_idxs = perm[start:start + self.batch_size]
+                yield self.inputs[batch_idxs], self.labels[batch_idxs]
 
 
 def get_device(force_cpu, status=True):